@@ -1,71 +1,232 @@
 #!/usr/bin/env python3
 
+from __future__ import annotations
+
 import os
+import sys
 import json
+import math
+import time
 import base64
+import hashlib
 import getpass
 import argparse
 import secrets
 import string
-import pyperclip
-import time
-
-from cryptography.fernet import Fernet
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
-from rich.console import Console
-from rich.table import Table
-from rich.panel import Panel
-from rich.prompt import Prompt, Confirm
+import struct
+import threading
+import functools
+from typing import TYPE_CHECKING, Union
+
+# cryptography, rich and pyperclip are imported inside the functions that use
+# them so that `pw --help` and `pw gen` do not pay for loading all of them.
+if TYPE_CHECKING:
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM, ChaCha20Poly1305
+
+    AEADCipher = Union[AESGCM, ChaCha20Poly1305]
+
+# orjson is optional; it (de)serializes the vault several times faster than json
+try:
+    import orjson
+    dumps_json = orjson.dumps
+    loads_json = orjson.loads
+except ImportError:
+    def dumps_json(obj) -> bytes:
+        return json.dumps(obj).encode()
+    loads_json = json.loads
 
 # --- Constants ---
 VAULT_PATH = os.path.expanduser("~/.mypw_vault.enc")
+WAL_PATH = os.path.expanduser("~/.mypw_vault.wal.enc")  # Encrypted log of changes since the last full save
+INDEX_PATH = os.path.expanduser("~/.mypw_index.json")  # Opt-in UNENCRYPTED list of services and usernames
 SALT_SIZE = 16
-KDF_ITERATIONS = 480_000  # High number of iterations for security
+NONCE_SIZE = 12  # AES-GCM and ChaCha20-Poly1305 nonce length
+VAULT_VERSION = 4  # Leading byte of versioned vaults; legacy vaults start with base64 text
+SCRYPT_LOG2_N = 15  # scrypt cost parameter n = 2**15 (32 MiB of memory with r=8)
+SCRYPT_R = 8
+SCRYPT_P = 1
+SCRYPT_MAX_MEMORY = 256 * 1024 * 1024  # Upper bound on 128 * r * n accepted from a vault header
+SCRYPT_MAX_P = 16
+CIPHER_AES_GCM = 0  # Cipher id byte following the version byte
+CIPHER_CHACHA20_POLY1305 = 1
+KDF_PARAMS = struct.Struct(">BBB")  # scrypt log2(n), r, p stored ahead of the salt
+LEGACY_KDF_ITERATIONS = 480_000  # PBKDF2 iterations used by pre-versioned vaults
+GENERATION_SIZE = 16  # Random id ending the vault header, renewed on every full save
+WAL_RECORD_LENGTH = struct.Struct(">I")  # Length prefix of each write-ahead log record
+WAL_SEQUENCE = struct.Struct(">Q")  # Record position, authenticated along with the vault header
+WAL_COMPACT_RECORDS = 100  # Fold the log into the vault on login past this many records
+CLIPBOARD_CLEAR_SECONDS = 15
+LIST_TABLE_MAX_ROWS = 200  # Larger vaults are listed as plain text; Rich tables format row by row
 
 # --- Rich Console Initialization ---
-console = Console()
+
+@functools.lru_cache(maxsize=None)
+def _get_console():
+    """Returns the shared Rich console, creating it on first use."""
+    from rich.console import Console
+
+    return Console()
 
 # --- Core Cryptography Functions ---
 
-def derive_key(password: str, salt: bytes) -> bytes:
-    """Derives a secure encryption key from a password and salt using PBKDF2."""
-    kdf = PBKDF2HMAC(
-        algorithm=hashes.SHA256(),
-        length=32,
-        salt=salt,
-        iterations=KDF_ITERATIONS,
-    )
-    return base64.urlsafe_b64encode(kdf.derive(password.encode()))
+def derive_key(password: str, salt: bytes, log2_n: int = SCRYPT_LOG2_N, r: int = SCRYPT_R, p: int = SCRYPT_P) -> bytes:
+    """Derives a raw 32-byte encryption key from a password and salt using scrypt."""
+    from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
+
+    kdf = Scrypt(salt=salt, length=32, n=2**log2_n, r=r, p=p)
+    return kdf.derive(password.encode())
+
+def derive_legacy_key(password: str, salt: bytes) -> bytes:
+    """Derives the PBKDF2 key used by vaults written before the versioned format."""
+    # hashlib runs the whole loop inside OpenSSL, which precomputes the HMAC
+    # inner/outer pad states once instead of rehashing them every iteration and
+    # uses the CPU's SHA extensions when present
+    return hashlib.pbkdf2_hmac("sha256", password.encode(), salt, LEGACY_KDF_ITERATIONS, 32)
+
+def new_kdf_header() -> bytes:
+    """Builds a fresh KDF header: scrypt parameters followed by a random salt."""
+    return KDF_PARAMS.pack(SCRYPT_LOG2_N, SCRYPT_R, SCRYPT_P) + os.urandom(SALT_SIZE)
+
+def derive_header_key(password: str, kdf_header: bytes) -> bytes:
+    """Derives the key described by a KDF header from new_kdf_header.
+
+    The header is only authenticated after the key exists, so its scrypt
+    parameters are bounds-checked first; a tampered header raises ValueError
+    instead of crashing scrypt or exhausting memory.
+    """
+    log2_n, r, p = KDF_PARAMS.unpack_from(kdf_header)
+    if not (1 <= log2_n <= 32 and 1 <= r and 1 <= p <= SCRYPT_MAX_P and 128 * r * 2**log2_n <= SCRYPT_MAX_MEMORY):
+        raise ValueError(f"Unsupported scrypt parameters: log2_n={log2_n}, r={r}, p={p}")
+    return derive_key(password, kdf_header[KDF_PARAMS.size:], log2_n, r, p)
+
+def split_vault_blob(encrypted_blob: bytes) -> tuple:
+    """Splits a vault blob into its (version, header, kdf_header, payload) parts.
+
+    ``header`` is everything before the payload and is authenticated as
+    associated data. Legacy vaults (base64 text, PBKDF2, Fernet) report
+    version 0, no header, and use the bare salt as their KDF header.
+    """
+    if encrypted_blob[:1] == bytes([VAULT_VERSION]):
+        kdf_header_end = 2 + KDF_PARAMS.size + SALT_SIZE
+        header_size = kdf_header_end + GENERATION_SIZE
+        header = encrypted_blob[:header_size]
+        return VAULT_VERSION, header, header[2:kdf_header_end], encrypted_blob[header_size:]
+    decoded_blob = base64.b64decode(encrypted_blob)
+    return 0, b"", decoded_blob[:SALT_SIZE], decoded_blob[SALT_SIZE:]
+
+def key_for_blob(password: str, version: int, kdf_header: bytes) -> bytes:
+    """Derives the key for a vault blob, using PBKDF2 for legacy vaults."""
+    if version == 0:
+        return derive_legacy_key(password, kdf_header)
+    return derive_header_key(password, kdf_header)
+
+def has_aes_acceleration() -> bool:
+    """Reports whether the CPU advertises AES instructions (x86 AES-NI or ARMv8 AES).
+
+    Without /proc/cpuinfo (macOS, Windows) AES is assumed, as current x86-64
+    and Apple silicon CPUs all have it.
+    """
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                name, _, value = line.partition(":")
+                if name.strip() in ("flags", "Features"):
+                    return "aes" in value.split()
+    except OSError:
+        pass
+    return True
+
+def new_vault_header(kdf_header: bytes) -> bytes:
+    """Builds a current-format header, picking the faster AEAD for this CPU.
+
+    ChaCha20-Poly1305 outruns software AES on CPUs without AES instructions,
+    such as the Raspberry Pi 4 and older x86 machines.
+    """
+    cipher_id = CIPHER_AES_GCM if has_aes_acceleration() else CIPHER_CHACHA20_POLY1305
+    return bytes([VAULT_VERSION, cipher_id]) + kdf_header + os.urandom(GENERATION_SIZE)
+
+def renew_generation(header: bytes) -> bytes:
+    """Returns header with a fresh generation id, invalidating log records sealed under the old one."""
+    return header[:-GENERATION_SIZE] + os.urandom(GENERATION_SIZE)
+
+def cipher_for_header(header: bytes, key: bytes) -> AEADCipher:
+    """Builds the AEAD cipher named by a vault header."""
+    return aead_cipher(header[1], key)
+
+@functools.lru_cache(maxsize=4)
+def aead_cipher(cipher_id: int, key: bytes) -> AEADCipher:
+    """Builds the AEAD cipher for a cipher id.
+
+    Cached so decrypting the vault, replaying its log and later saves share one
+    instance; MyPW.logout clears the cache so no key outlives the session.
+    """
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM, ChaCha20Poly1305
+
+    if cipher_id == CIPHER_AES_GCM:
+        return AESGCM(key)
+    if cipher_id == CIPHER_CHACHA20_POLY1305:
+        return ChaCha20Poly1305(key)
+    raise ValueError(f"Unknown cipher id {cipher_id}")
 
 def encrypt_data(data: dict, password: str) -> bytes:
     """Encrypts a data dictionary into a secure, storable format."""
-    salt = os.urandom(SALT_SIZE)
-    key = derive_key(password, salt)
-    f = Fernet(key)
-    encrypted_data = f.encrypt(json.dumps(data).encode())
-    # Return salt and encrypted data, concatenated and base64 encoded for safe storage
-    return base64.b64encode(salt + encrypted_data)
+    kdf_header = new_kdf_header()
+    header = new_vault_header(kdf_header)
+    return encrypt_with_cipher(data, cipher_for_header(header, derive_header_key(password, kdf_header)), header)
+
+def seal(cipher: AEADCipher, plaintext: bytes, associated_data: bytes) -> bytes:
+    """Encrypts plaintext under a fresh random nonce, returning nonce + ciphertext."""
+    nonce = os.urandom(NONCE_SIZE)
+    return nonce + cipher.encrypt(nonce, plaintext, associated_data)
+
+def unseal(cipher: AEADCipher, sealed: bytes, associated_data: bytes) -> bytes:
+    """Reverses seal, raising if the data was tampered with or the key is wrong."""
+    return cipher.decrypt(sealed[:NONCE_SIZE], sealed[NONCE_SIZE:], associated_data)
+
+def encrypt_with_cipher(data: dict, cipher: AEADCipher, header: bytes) -> bytes:
+    """Encrypts a data dictionary with an already-derived key, skipping the KDF."""
+    # The version byte, cipher id, KDF header and generation are authenticated as associated data
+    return header + seal(cipher, dumps_json(data), header)
+
+def print_decryption_error():
+    """Reports a failed vault decryption."""
+    _get_console().print("[bold red]Error: Decryption failed. Incorrect master password or corrupt vault.[/bold red]")
 
 def decrypt_data(encrypted_blob: bytes, password: str) -> dict:
     """Decrypts the vault data and returns the dictionary."""
     try:
-        decoded_blob = base64.b64decode(encrypted_blob)
-        salt = decoded_blob[:SALT_SIZE]
-        encrypted_data = decoded_blob[SALT_SIZE:]
-        key = derive_key(password, salt)
-        f = Fernet(key)
-        decrypted_data = f.decrypt(encrypted_data)
-        return json.loads(decrypted_data)
+        version, _, kdf_header, _ = split_vault_blob(encrypted_blob)
+        key = key_for_blob(password, version, kdf_header)
+    except Exception:
+        print_decryption_error()
+        return None
+    return decrypt_with_key(encrypted_blob, key)
+
+def decrypt_with_key(encrypted_blob: bytes, key: bytes) -> dict:
+    """Decrypts the vault data with an already-derived raw key."""
+    from cryptography.fernet import Fernet
+
+    try:
+        version, header, _, payload = split_vault_blob(encrypted_blob)
+        if version == VAULT_VERSION:
+            decrypted_data = unseal(cipher_for_header(header, key), payload, header)
+        else:
+            # Legacy vaults stored a Fernet token keyed with the base64 form of the key
+            decrypted_data = Fernet(base64.urlsafe_b64encode(key)).decrypt(payload)
+        return loads_json(decrypted_data)
     except Exception as e:
         # Catching broad exceptions because various crypto errors can occur
-        console.print("[bold red]Error: Decryption failed. Incorrect master password or corrupt vault.[/bold red]")
+        print_decryption_error()
         return None
 
 # --- Vault Management ---
 
 def initialize_vault():
     """Initializes a new, empty password vault."""
+    from rich.panel import Panel
+
+    console = _get_console()
+
     if os.path.exists(VAULT_PATH):
         console.print("[bold yellow]Warning:[/bold yellow] Vault already exists. Aborting initialization.")
         return
@@ -85,12 +246,18 @@ def initialize_vault():
     empty_vault = {"accounts": {}}
     encrypted_vault = encrypt_data(empty_vault, password)
 
-    with open(VAULT_PATH, "wb") as f:
-        f.write(encrypted_vault)
+    write_file_atomic(VAULT_PATH, encrypted_vault)
+    discard_wal()
+    update_index(empty_vault["accounts"])
 
     console.print("[bold green]✓ Vault initialized successfully at:[/bold green]", VAULT_PATH)
 
 def reset_vault():
+    from rich.panel import Panel
+    from rich.prompt import Prompt, Confirm
+
+    console = _get_console()
+
     if not os.path.exists(VAULT_PATH):
         console.print("[yellow]No vault found. Nothing to reset.[/yellow]")
         return
@@ -118,14 +285,24 @@ def reset_vault():
 
     try:
         os.remove(VAULT_PATH)
+        # initialize_vault may still abort, which must not leave the old services listed
+        disable_index()
         console.print("[green]✓ Old vault deleted.[/green]")
         initialize_vault()
     except Exception as e:
         console.print(f"[bold red]Reset failed: {e}[/bold red]")
 
 
-def load_vault(password: str) -> dict:
-    """Loads and decrypts the vault from disk."""
+def load_vault(password: str):
+    """Loads and decrypts the vault from disk.
+
+    Returns a ``(data, header, cipher, wal_records)`` tuple so callers can
+    save again without re-running the KDF and know the sequence number of the
+    next log record, or None on failure. Legacy PBKDF2 vaults are
+    rewritten in the current format with a fresh scrypt header on first load.
+    """
+    console = _get_console()
+
     if not os.path.exists(VAULT_PATH):
         console.print("[bold red]Error:[/bold red] Vault not found. Please run `pw init` first.")
         return None
@@ -133,33 +310,357 @@ def load_vault(password: str) -> dict:
     with open(VAULT_PATH, "rb") as f:
         encrypted_blob = f.read()
 
-    return decrypt_data(encrypted_blob, password)
+    try:
+        version, header, kdf_header, _ = split_vault_blob(encrypted_blob)
+        key = key_for_blob(password, version, kdf_header)
+    except Exception:
+        print_decryption_error()
+        return None
 
-def save_vault(data: dict, password: str):
-    """Encrypts and saves the vault to disk."""
-    encrypted_vault = encrypt_data(data, password)
-    with open(VAULT_PATH, "wb") as f:
-        f.write(encrypted_vault)
+    data = decrypt_with_key(encrypted_blob, key)
+    if data is None:
+        return None
+
+    if version != VAULT_VERSION:
+        # Legacy vaults predate the write-ahead log, so there is nothing to replay
+        kdf_header = new_kdf_header()
+        header = new_vault_header(kdf_header)
+        cipher = cipher_for_header(header, derive_header_key(password, kdf_header))
+        header = save_vault(data, cipher, header)
+        console.print("[dim]Vault upgraded to the current format.[/dim]")
+        return data, header, cipher, 0
+
+    cipher = cipher_for_header(header, key)
+    baseline_digest = data_digest(data) if os.path.exists(WAL_PATH) else None
+    replayed, complete = replay_wal(data, cipher, header)
+    if not complete:
+        # The index was written as the dropped changes were made, so it may list services the vault lacks
+        update_index(data["accounts"])
+
+    if replayed and (replayed > WAL_COMPACT_RECORDS or os.path.getsize(WAL_PATH) > len(encrypted_blob) // 4):
+        if data_digest(data) == baseline_digest:
+            # The logged changes cancel out, so the vault on disk is already current
+            discard_wal()
+        else:
+            header = save_vault(data, cipher, header)
+        replayed = 0
+    return data, header, cipher, replayed
+
+def save_vault(data: dict, cipher: AEADCipher, header: bytes) -> bytes:
+    """Encrypts and saves the full vault to disk, folding in the write-ahead log.
+
+    The vault is written under a fresh generation id, which is returned as
+    part of the new header; log records must be sealed with that header.
+    """
+    header = renew_generation(header)
+    write_file_atomic(VAULT_PATH, encrypt_with_cipher(data, cipher, header))
+    # A log left behind by a crash here belongs to the old generation and is
+    # ignored by replay_wal
+    discard_wal()
+    return header
+
+def wal_associated_data(header: bytes, sequence: int) -> bytes:
+    """Binds a log record to the vault generation it extends and its position in the log."""
+    return header + WAL_SEQUENCE.pack(sequence)
+
+def iter_wal_records(log: bytes):
+    """Yields ``(end, sealed)`` for each complete record of a log, stopping at a truncated tail."""
+    offset = GENERATION_SIZE
+    while offset + WAL_RECORD_LENGTH.size <= len(log):
+        (length,) = WAL_RECORD_LENGTH.unpack_from(log, offset)
+        start = offset + WAL_RECORD_LENGTH.size
+        if start + length > len(log):
+            return
+        offset = start + length
+        yield offset, log[start:offset]
+
+def append_wal(record: dict, cipher: AEADCipher, header: bytes, sequence: int) -> bool:
+    """Appends one encrypted change record to the write-ahead log.
+
+    Records are ``{"op": "set", "service": ..., "entry": {...}}`` or
+    ``{"op": "delete", "service": ...}``, so a change costs the same however
+    large the vault is. ``sequence`` is the number of records already in the
+    log; the first record starts a new log tagged with the vault generation.
+
+    Returns False without writing anything if another session has saved the
+    vault or logged changes since this one loaded it, since appending would
+    then lose the change on the next replay.
+    """
+    with open(VAULT_PATH, "rb") as f:
+        if f.read(len(header)) != header:
+            return False
+    try:
+        with open(WAL_PATH, "rb") as f:
+            log = f.read()
+    except FileNotFoundError:
+        log = None
+
+    sealed = seal(cipher, dumps_json(record), wal_associated_data(header, sequence))
+    entry = WAL_RECORD_LENGTH.pack(len(sealed)) + sealed
+    flags = os.O_WRONLY | getattr(os, "O_BINARY", 0)
+    if log is None:
+        if sequence:
+            return False
+        # O_EXCL so a log started by another session at the same time is not replaced
+        flags |= os.O_CREAT | os.O_EXCL
+        entry = header[-GENERATION_SIZE:] + entry
+    else:
+        records = list(iter_wal_records(log))
+        if log[:GENERATION_SIZE] != header[-GENERATION_SIZE:] or len(records) != sequence:
+            return False
+        if records and records[-1][0] != len(log):
+            return False
+        # No O_CREAT, so a log removed by another session's save is not recreated untagged
+        flags |= os.O_APPEND
+    try:
+        fd = os.open(WAL_PATH, flags, 0o600)
+    except (FileExistsError, FileNotFoundError):
+        return False
+    try:
+        os.write(fd, entry)
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    return True
+
+def set_aside_wal(contents: bytes) -> str:
+    """Saves log records that could not be replayed next to the log and returns their path.
+
+    Each copy gets a new timestamped name, so an earlier copy is never overwritten.
+    """
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    attempt = 0
+    while True:
+        corrupt_path = f"{WAL_PATH}.{stamp}{f'-{attempt}' if attempt else ''}.corrupt"
+        try:
+            fd = os.open(corrupt_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0), 0o600)
+        except FileExistsError:
+            attempt += 1
+            continue
+        try:
+            os.write(fd, contents)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        return corrupt_path
+
+def replay_wal(data: dict, cipher: AEADCipher, header: bytes) -> tuple:
+    """Applies logged changes to the vault data in order.
+
+    Returns ``(replayed, complete)``: how many records were applied, and
+    whether that was every record in the log.
+
+    A log tagged with another generation predates the last full save, which
+    normally already contains its changes; it is not applied, and any records
+    in it are moved to a ``.corrupt`` copy with a warning. A truncated final
+    record left by an interrupted write is cut off the log. Replay also stops
+    at the first record that fails to authenticate; it and everything after it
+    are moved to a ``.corrupt`` copy so the vault still opens with the changes
+    logged before it. See set_aside_wal for how those copies are named.
+    """
+    if not os.path.exists(WAL_PATH):
+        return 0, True
+
+    with open(WAL_PATH, "rb") as f:
+        log = f.read()
+
+    if log[:GENERATION_SIZE] != header[-GENERATION_SIZE:]:
+        if len(log) > GENERATION_SIZE:
+            corrupt_path = set_aside_wal(log)
+            _get_console().print(
+                f"[bold yellow]Warning:[/bold yellow] Change log {WAL_PATH} does not belong to the current vault "
+                f"and was not applied. It was saved to {corrupt_path}."
+            )
+        discard_wal()
+        return 0, len(log) <= GENERATION_SIZE
+
+    offset = GENERATION_SIZE
+    replayed = 0
+    complete = True
+    for end, sealed in iter_wal_records(log):
+        try:
+            record = loads_json(unseal(cipher, sealed, wal_associated_data(header, replayed)))
+            if record["op"] == "set":
+                data["accounts"][record["service"]] = record["entry"]
+            elif record["op"] == "delete":
+                data["accounts"].pop(record["service"], None)
+        except Exception:
+            # Catching broad exceptions because various crypto errors can occur
+            corrupt_path = set_aside_wal(log[offset:])
+            _get_console().print(
+                f"[bold red]Error:[/bold red] Change log {WAL_PATH} is corrupt after {replayed} record(s). "
+                f"Later changes were not applied and the rest of the log was saved to {corrupt_path}."
+            )
+            complete = False
+            break
+        offset = end
+        replayed += 1
+
+    if offset < len(log):
+        os.truncate(WAL_PATH, offset)
+    return replayed, complete
+
+def write_file_atomic(path: str, contents: bytes):
+    """Writes a file via a synced temporary file and os.replace.
+
+    A crash mid-write leaves either the old or the new file, never a
+    truncated one, and the file is created readable by the owner only.
+    """
+    tmp_path = path + ".tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0), 0o600)
+    try:
+        os.write(fd, contents)
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    os.replace(tmp_path, path)
+
+def data_digest(data: dict) -> bytes:
+    """Returns a short digest of the serialized vault data to detect no-op rewrites."""
+    return hashlib.blake2b(dumps_json(data), digest_size=16).digest()
+
+def discard_wal():
+    """Removes the write-ahead log, if any."""
+    if os.path.exists(WAL_PATH):
+        os.remove(WAL_PATH)
+
+# --- Service Index ---
+
+def index_enabled() -> bool:
+    """Reports whether the user opted in to the unencrypted service index."""
+    return os.path.exists(INDEX_PATH)
+
+def load_index() -> dict:
+    """Reads the service index in vault layout, or returns None if it is unreadable."""
+    try:
+        with open(INDEX_PATH, "rb") as f:
+            index = loads_json(f.read())
+    except (OSError, ValueError):
+        return None
+    if not isinstance(index, dict) or not isinstance(index.get("accounts"), dict):
+        return None
+    return index
+
+def write_index(accounts: dict):
+    """Writes service names and usernames, never passwords, to the index file."""
+    index = {"accounts": {service: {"username": details["username"]} for service, details in accounts.items()}}
+    write_file_atomic(INDEX_PATH, dumps_json(index))
+
+def update_index(accounts: dict):
+    """Keeps the service index in sync with the vault when it is enabled."""
+    if index_enabled():
+        write_index(accounts)
+
+def disable_index():
+    """Deletes the service index, if any."""
+    if os.path.exists(INDEX_PATH):
+        os.remove(INDEX_PATH)
+
+# --- Password Generation ---
+
+# Every alphabet generate_password can ask for, indexed by a 4-bit flag:
+# uppercase << 3 | lowercase << 2 | digits << 1 | symbols
+_ALPHABET_PARTS = (
+    (8, string.ascii_uppercase),
+    (4, string.ascii_lowercase),
+    (2, string.digits),
+    (1, string.punctuation),
+)
+_ALPHABETS = tuple("".join(part for bit, part in _ALPHABET_PARTS if flags & bit) for flags in range(16))
+
+def random_string(alphabet: str, length: int) -> str:
+    """Draws a uniformly random string from alphabet using batched CSPRNG reads."""
+    size = len(alphabet)
+    mask = (1 << size.bit_length()) - 1  # Smallest all-ones mask covering every index
+    chars = []
+    while len(chars) < length:
+        # One os.urandom call per batch; masked bytes past the alphabet are
+        # rejected rather than wrapped so every character stays equally likely
+        for byte in secrets.token_bytes(length * 2):
+            index = byte & mask
+            if index < size:
+                chars.append(alphabet[index])
+                if len(chars) == length:
+                    break
+    return ''.join(chars)
 
 # --- CLI Application Class ---
 
 class MyPW:
     def __init__(self):
-        self.master_password = None
         self.vault_data = None
+        # Derived key and vault header cached after login so saves skip the KDF.
+        # The master password itself is never kept once the key is derived.
+        self._header = None
+        self._cipher = None
+        self._wal_records = 0  # Sequence number of the next write-ahead log record
+        self._clipboard_timer = None
+        self._clipboard_clear_at = None
 
     def login(self):
         """Prompts for master password and loads vault."""
         if not os.path.exists(VAULT_PATH):
-             console.print("[bold red]Error:[/bold red] No vault found. Please run `pw init` to get started.")
+             _get_console().print("[bold red]Error:[/bold red] No vault found. Please run `pw init` to get started.")
              exit(1)
-        self.master_password = getpass.getpass("Enter master password: ")
-        self.vault_data = load_vault(self.master_password)
-        if self.vault_data is None:
+        loaded = load_vault(getpass.getpass("Enter master password: "))
+        if loaded is None:
             exit(1)
+        self.vault_data, self._header, self._cipher, self._wal_records = loaded
+
+    def logout(self):
+        """Drops the cached key and decrypted vault data."""
+        self.vault_data = None
+        self._header = None
+        self._cipher = None
+        self._wal_records = 0
+        aead_cipher.cache_clear()
+
+    def log_change(self, record: dict) -> bool:
+        """Appends a change record to the write-ahead log at the next sequence number.
+
+        Returns False, after telling the user to unlock again, if the vault was
+        changed by another session since this one loaded it.
+        """
+        if not append_wal(record, self._cipher, self._header, self._wal_records):
+            _get_console().print(
+                "[bold red]Error:[/bold red] The vault was changed by another pw session since it was unlocked. "
+                "Unlock it again and retry; nothing was saved."
+            )
+            return False
+        self._wal_records += 1
+        return True
+
+    def change_master_password(self):
+        """Re-encrypts the vault under a new master password and a fresh salt."""
+        console = _get_console()
+
+        password = getpass.getpass("Enter a new master password: ")
+        password_confirm = getpass.getpass("Confirm new master password: ")
+
+        if password != password_confirm:
+            console.print("[bold red]Error: Passwords do not match.[/bold red]")
+            return
+
+        if not password:
+            console.print("[bold red]Error: Master password cannot be empty.[/bold red]")
+            return
+
+        kdf_header = new_kdf_header()
+        header = new_vault_header(kdf_header)
+        cipher = cipher_for_header(header, derive_header_key(password, kdf_header))
+        # Pending log records belong to the old generation, so a crash right
+        # after the new vault is written cannot replay them against it
+        self._header = save_vault(self.vault_data, cipher, header)
+        self._cipher = cipher
+        self._wal_records = 0
+        console.print("[bold green]✓ Master password changed.[/bold green]")
 
     def display_banner(self):
         """Displays the ASCII art banner."""
+        from rich.panel import Panel
+
+        console = _get_console()
+
         console.print(Panel("""[bold cyan]
 
 ███╗░░░███╗  ██╗░░░██╗  ██████╗░  ██╗░░░░░██╗
@@ -174,28 +675,25 @@ class MyPW:
 
     def generate_password(self, length=20, include_symbols=True, include_uppercase=True, include_lowercase=True, include_numbers=True):
         """Generates a strong, random password."""
-        alphabet = ""
-        if include_uppercase:
-            alphabet += string.ascii_uppercase
-        if include_lowercase:
-            alphabet += string.ascii_lowercase
-        if include_numbers:
-            alphabet += string.digits
-        if include_symbols:
-            alphabet += string.punctuation
+        alphabet = _ALPHABETS[bool(include_uppercase) << 3 | bool(include_lowercase) << 2 | bool(include_numbers) << 1 | bool(include_symbols)]
 
         if not alphabet:
-            console.print("[bold red]Cannot generate password with no character types selected.[/bold red]")
+            _get_console().print("[bold red]Cannot generate password with no character types selected.[/bold red]")
             return None
 
-        return ''.join(secrets.choice(alphabet) for i in range(length))
+        return random_string(alphabet, length)
 
     def add_entry(self):
         """Adds a new password entry to the vault."""
+        from rich.prompt import Prompt, Confirm
+
+        console = _get_console()
+
         console.print("\n[bold underline cyan]Add New Entry[/bold underline cyan]")
         service = Prompt.ask("Enter service name (e.g., Google, GitHub)")
+        key = service.lower()
         
-        if service.lower() in self.vault_data['accounts']:
+        if key in self.vault_data['accounts']:
             if not Confirm.ask(f"[yellow]Service '{service}' already exists. Overwrite?[/yellow]"):
                 console.print("[dim]Operation cancelled.[/dim]")
                 return
@@ -208,12 +706,21 @@ class MyPW:
         else:
             password = getpass.getpass("Enter password: ")
 
-        self.vault_data['accounts'][service.lower()] = {"username": username, "password": password}
-        save_vault(self.vault_data, self.master_password)
+        entry = {"username": username, "password": password}
+        if not self.log_change({"op": "set", "service": key, "entry": entry}):
+            return
+        self.vault_data['accounts'][key] = entry
+        update_index(self.vault_data['accounts'])
         console.print(f"[bold green]✓ Entry for '{service}' added successfully.[/bold green]")
 
     def get_entry(self, service_name):
         """Retrieves and displays a specific entry."""
+        import pyperclip
+        from rich.prompt import Confirm
+        from rich.table import Table
+
+        console = _get_console()
+
         entry = self.vault_data['accounts'].get(service_name.lower())
         if not entry:
             console.print(f"[bold red]Error:[/bold red] No entry found for '{service_name}'.")
@@ -226,46 +733,114 @@ class MyPW:
         table.add_row("Password", "********")
         console.print(table)
 
-        if Confirm.ask("\nCopy password to clipboard? (clears in 15s)", default=True):
+        if Confirm.ask(f"\nCopy password to clipboard? (clears in {CLIPBOARD_CLEAR_SECONDS}s)", default=True):
             pyperclip.copy(entry['password'])
-            console.print("[green]Password copied to clipboard. It will be cleared in 15 seconds.[/green]", end="")
-            for i in range(15, 0, -1):
-                time.sleep(1)
-                print(f"\r[green]Password copied to clipboard. It will be cleared in {i:2d} seconds.[/green]", end="")
-            pyperclip.copy("") # Clear clipboard
-            print("\r[bold yellow]Clipboard cleared.                                              [/bold yellow]")
-
-    def list_entries(self):
-        """Lists all entries in a table."""
+            self.schedule_clipboard_clear()
+            console.print(f"[green]Password copied to clipboard. It will be cleared in {CLIPBOARD_CLEAR_SECONDS} seconds.[/green]")
+
+    def schedule_clipboard_clear(self):
+        """Clears the clipboard in the background after CLIPBOARD_CLEAR_SECONDS.
+
+        The timer thread is non-daemon so a one-shot `pw get` still clears the
+        clipboard before the process exits; copying again restarts the timer.
+        """
+        import pyperclip
+
+        if self._clipboard_timer is not None:
+            self._clipboard_timer.cancel()
+        self._clipboard_timer = threading.Timer(CLIPBOARD_CLEAR_SECONDS, pyperclip.copy, args=("",))
+        self._clipboard_clear_at = time.monotonic() + CLIPBOARD_CLEAR_SECONDS
+        self._clipboard_timer.start()
+
+    def wait_for_clipboard_clear(self):
+        """Blocks until the pending clipboard clear fires, with a live countdown on a terminal.
+
+        Used by the one-shot `pw get`, whose process has to outlive the timer
+        anyway; Ctrl-C clears the clipboard straight away instead.
+        """
+        timer = self._clipboard_timer
+        if timer is None or not timer.is_alive():
+            return
+
+        console = _get_console()
+        try:
+            if console.is_terminal:
+                from rich.live import Live
+                from rich.text import Text
+
+                # One in-place region redrawn once a second instead of raw \r prints
+                with Live(console=console, auto_refresh=False, transient=True) as live:
+                    while timer.is_alive():
+                        remaining = self._clipboard_clear_at - time.monotonic()
+                        live.update(Text(f"Clipboard will be cleared in {max(1, math.ceil(remaining)):2d} seconds.", style="green"), refresh=True)
+                        timer.join(timeout=remaining - math.ceil(remaining) + 1)  # Until the next whole second
+            else:
+                timer.join()
+        except KeyboardInterrupt:
+            self.clear_clipboard_now()
+        console.print("[bold yellow]Clipboard cleared.[/bold yellow]")
+
+    def clear_clipboard_now(self):
+        """Cancels any pending clear timer and clears the clipboard immediately."""
+        if self._clipboard_timer is not None and self._clipboard_timer.is_alive():
+            import pyperclip
+
+            self._clipboard_timer.cancel()
+            pyperclip.copy("")
+        self._clipboard_timer = None
+
+    def list_entries(self, plain=False):
+        """Lists all entries in a table, or as tab-separated lines for large vaults or `--plain`."""
+        from rich.table import Table
+
+        console = _get_console()
+
         accounts = self.vault_data.get('accounts', {})
         if not accounts:
             console.print("[yellow]Your vault is empty. Use `pw add` to add an entry.[/yellow]")
             return
+
+        rows = [(service, details['username']) for service, details in sorted(accounts.items())]
+        if plain or len(rows) > LIST_TABLE_MAX_ROWS:
+            sys.stdout.write("".join(f"{service}\t{username}\n" for service, username in rows))
+            return
             
         table = Table(title="MyPW Vault", show_header=True, header_style="bold magenta")
         table.add_column("Service", style="cyan", no_wrap=True)
         table.add_column("Username", style="green")
         
-        for service, details in sorted(accounts.items()):
-            table.add_row(service, details['username'])
+        for row in rows:
+            table.add_row(*row)
             
         console.print(table)
 
     def delete_entry(self, service_name):
         """Deletes an entry from the vault."""
-        if service_name.lower() not in self.vault_data['accounts']:
+        from rich.prompt import Confirm
+
+        console = _get_console()
+
+        key = service_name.lower()
+        if key not in self.vault_data['accounts']:
             console.print(f"[bold red]Error:[/bold red] No entry found for '{service_name}'.")
             return
             
         if Confirm.ask(f"Are you sure you want to delete the entry for '{service_name}'?"):
-            del self.vault_data['accounts'][service_name.lower()]
-            save_vault(self.vault_data, self.master_password)
+            if not self.log_change({"op": "delete", "service": key}):
+                return
+            del self.vault_data['accounts'][key]
+            update_index(self.vault_data['accounts'])
             console.print(f"[bold green]✓ Entry for '{service_name}' deleted.[/bold green]")
         else:
             console.print("[dim]Operation cancelled.[/dim]")
 
     def interactive_mode(self):
         """Runs the main interactive menu loop."""
+        import pyperclip
+        from rich.prompt import Prompt
+
+        console = _get_console()
+
         self.display_banner()
         self.login()
 
@@ -293,15 +868,99 @@ class MyPW:
                 pyperclip.copy(password)
                 console.print("[dim]Copied to clipboard.[/dim]")
             elif choice == "quit":
+                self.clear_clipboard_now()
+                self.logout()
                 console.print("[bold cyan]Goodbye![/bold cyan]")
                 break
 # --- Main Execution ---
+
+def run_add(app, args):
+    """Handles `pw add`."""
+    app.login()
+    app.add_entry()
+
+def run_get(app, args):
+    """Handles `pw get`, staying alive until the clipboard has been cleared."""
+    app.login()
+    app.get_entry(args.service)
+    app.wait_for_clipboard_clear()
+
+def run_list(app, args):
+    """Handles `pw list`, reading the service index instead of the vault when enabled."""
+    if index_enabled():
+        # The index lists services without asking for the master password
+        app.vault_data = load_index()
+    if app.vault_data is None:
+        app.login()
+    app.list_entries(plain=args.plain)
+
+def run_delete(app, args):
+    """Handles `pw delete`."""
+    app.login()
+    app.delete_entry(args.service)
+
+def run_passwd(app, args):
+    """Handles `pw passwd`."""
+    app.login()
+    app.change_master_password()
+
+def run_index(app, args):
+    """Handles `pw index on|off`."""
+    console = _get_console()
+
+    if args.state == "on":
+        app.login()
+        write_index(app.vault_data['accounts'])
+        console.print(f"[bold green]✓ Service index written to {INDEX_PATH}.[/bold green]")
+        console.print("[yellow]Service names and usernames in this file are NOT encrypted.[/yellow]")
+    else:
+        disable_index()
+        console.print("[bold green]✓ Service index removed.[/bold green]")
+
+def run_gen(app, args):
+    """Handles `pw gen`."""
+    import pyperclip
+
+    console = _get_console()
+
+    password = app.generate_password(length=args.length)
+    console.print(f"Generated Password: [bold green]{password}[/bold green]")
+    pyperclip.copy(password)
+    console.print("[dim]Copied to clipboard.[/dim]")
+
+def run_interactive(app, args):
+    """Runs the interactive menu when no subcommand is given."""
+    console = _get_console()
+
+    try:
+        app.interactive_mode()
+    except KeyboardInterrupt:
+        app.clear_clipboard_now()
+        app.logout()
+        console.print("\n[bold cyan]Goodbye![/bold cyan]")
+    except Exception as e:
+        console.print(f"[bold red]An unexpected error occurred: {e}[/bold red]")
+
+# Subcommand name -> handler(app, args); no subcommand falls back to run_interactive
+COMMANDS = {
+    "init": lambda app, args: initialize_vault(),
+    "reset": lambda app, args: reset_vault(),
+    "add": run_add,
+    "get": run_get,
+    "list": run_list,
+    "delete": run_delete,
+    "passwd": run_passwd,
+    "index": run_index,
+    "gen": run_gen,
+}
+
 def main():
     parser = argparse.ArgumentParser(description="MyPW: A modern terminal password manager.")
     subparsers = parser.add_subparsers(dest="command", help="Available commands")
 
     subparsers.add_parser("init", help="Initialize a new password vault.")
     subparsers.add_parser("add", help="Add a new password entry.")
+    subparsers.add_parser("passwd", help="Change the master password, keeping all stored data.")
     subparsers.add_parser("reset", help="Reset master password (DESTROYS all stored data).")
 
     
@@ -309,45 +968,20 @@ def main():
     get_parser.add_argument("service", help="Name of the service.")
     
     list_parser = subparsers.add_parser("list", help="List all services in the vault.")
+    list_parser.add_argument("--plain", action="store_true", help="Print tab-separated lines instead of a table.")
     
     delete_parser = subparsers.add_parser("delete", help="Delete a password entry.")
     delete_parser.add_argument("service", help="Name of the service to delete.")
 
+    index_parser = subparsers.add_parser("index", help="Turn the unencrypted service index used by `pw list` on or off.")
+    index_parser.add_argument("state", choices=["on", "off"], help="'on' writes service names and usernames in plain text; 'off' deletes them.")
+
     gen_parser = subparsers.add_parser("gen", help="Generate a new secure password.")
     gen_parser.add_argument("-l", "--length", type=int, default=20, help="Password length.")
 
     args = parser.parse_args()
-    app = MyPW()
-
-    if args.command == "init":
-        initialize_vault()
-
-    elif args.command == "reset":
-    reset_vault()
-
-    elif args.command in ["add", "get", "list", "delete"]:
-        app.login()
-        if args.command == "add":
-            app.add_entry()
-        elif args.command == "get":
-            app.get_entry(args.service)
-        elif args.command == "list":
-            app.list_entries()
-        elif args.command == "delete":
-            app.delete_entry(args.service)
-    elif args.command == "gen":
-        password = app.generate_password(length=args.length)
-        console.print(f"Generated Password: [bold green]{password}[/bold green]")
-        pyperclip.copy(password)
-        console.print("[dim]Copied to clipboard.[/dim]")
-    else:
-        # Interactive Mode
-        try:
-            app.interactive_mode()
-        except KeyboardInterrupt:
-            console.print("\n[bold cyan]Goodbye![/bold cyan]")
-        except Exception as e:
-            console.print(f"[bold red]An unexpected error occurred: {e}[/bold red]")
+    handler = COMMANDS.get(args.command, run_interactive)
+    handler(MyPW(), args)
 
 if __name__ == "__main__":
     main()